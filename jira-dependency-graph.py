@@ -3,34 +3,255 @@
 from __future__ import print_function
 
 import argparse
+import atexit
 import getpass
+import hashlib
 import itertools
+import json
 import os
 import sys
+import tempfile
 import textwrap
 import threading
 import time
 import typing
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from functools import reduce
-from typing import Any, Dict, List, Literal, Optional, Tuple, Union
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    List,
+    Literal,
+    Optional,
+    Set,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.models import Response
+from urllib3.util.retry import Retry
 
-from schemas.issue_links import Fields, IssueRef
-from schemas.jira import Issue, IssueFields, IssueLink, Status
+try:
+    # orjson parses the (large) search responses a lot faster, but is optional
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads  # type: ignore
+
+from schemas.issue_links import Fields, IssueLink, IssueRef
+from schemas.jira import Issue, IssueFields, Status
 
 GOOGLE_CHART_URL = "https://chart.apis.google.com/chart"
 MAX_SUMMARY_LENGTH = 30
+FETCH_WORKERS = 8
+BULK_FETCH_SIZE = 100
+LIST_IDS_PAGE_SIZE = 1000
+# link type whose two directions are merged into one edge by --merge-relates
+MERGED_LINK_TYPE = "Relates"
+
+# node fill color by status category, anything else is white
+STATUS_COLORS = {"IN PROGRESS": "yellow", "DONE": "green"}
+# extra edge attributes by link type
+EDGE_EXTRA = {"blocks": ',color="red"', "has to be done before": ',color="orange"'}
+# link types that are followed but never drawn
+SKIP_LINKS: FrozenSet[str] = frozenset(
+    [
+        # "added to idea",
+        # "created by",
+        # "has to be done before",
+        # "is blocked by",
+        # "is caused by",
+        # "is child of",
+        # "is cloned by",
+        # "is depended by",
+        # "is discovered by testing",
+        # "is duplicated by",
+        # "is implemented by",
+        # "is resolved by"
+        # "is reviewed by",
+        # "is tested by",
+        # "split from",
+    ]
+)
 
 FETCHED_ISSUES: Dict[str, Issue] = {}
+FETCHED_ISSUES_LOCK = threading.Lock()
+
+ISSUE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "jira-dep-graph")
 
 
 def log(*args) -> None:
     print(*args, file=sys.stderr)
 
 
+def parse_json(response: Response) -> Any:
+    return json_loads(response.content)
+
+
+def other_end(link: IssueLink) -> Optional[IssueRef]:
+    """The issue on the other end of `link`."""
+    return link.outwardIssue or link.inwardIssue
+
+
+def chunks(lst: List, size: int) -> List[List]:
+    return [lst[i : i + size] for i in range(0, len(lst), size)]  # noqa: E203
+
+
+class IssueCache(object):
+
+    """Issues fetched by previous runs, stored on disk together with the `updated`
+    timestamp JIRA reported for them. A cached issue can be reused for as long as JIRA
+    reports the same timestamp, which is a lot cheaper to ask for than the issue.
+    Issues checked less than `ttl` seconds ago are reused without asking at all.
+
+    A cached issue also embeds copies of its linked issues and subtasks, and JIRA
+    doesn't bump its `updated` when one of those changes, so the timestamps of the
+    embedded issues are recorded and have to match as well."""
+
+    def __init__(self, path: str, ttl: float = 0, load: bool = True) -> None:
+        self.path = path
+        self.ttl = ttl
+        # keys whose entries were added or touched, only those are written on save
+        self.dirty: Set[str] = set()
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        # `updated` timestamps seen during this run, None for issues JIRA didn't return
+        self.known: Dict[str, Optional[str]] = {}
+        # keys fetched during this run, their embedded timestamps are recorded on save
+        self.stored: Set[str] = set()
+        if load:
+            self.entries = self.read()
+
+    def read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path) as cache:
+                entries: Dict[str, Dict[str, Any]] = json.load(cache)
+            return entries
+        except (OSError, ValueError):
+            # no usable cache yet, it gets created on save
+            return {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def parse(self, entry: Dict[str, Any]) -> Optional[Issue]:
+        try:
+            return Issue.parse_obj(entry["issue"])
+        except (KeyError, ValueError):
+            return None
+
+    def get_fresh(self, key: str) -> Optional[Issue]:
+        """Return the cached issue if it was checked within the last `ttl` seconds."""
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry.get("checked", 0) >= self.ttl:
+            return None
+        return self.parse(entry)
+
+    def embedded_keys(self, key: str) -> List[str]:
+        """Keys of the linked issues and subtasks embedded in the cached issue."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return []
+        fields = entry["issue"].get("fields", {})
+        keys = [subtask["key"] for subtask in fields.get("subtasks") or []]
+        for link in fields.get("issuelinks") or []:
+            ref = link.get("outwardIssue") or link.get("inwardIssue")
+            if ref is not None:
+                keys.append(ref["key"])
+        return keys
+
+    def known_timestamps(self, keys: Set[str]) -> Dict[str, Optional[str]]:
+        """The timestamps of `keys` already seen during this run."""
+        with self.lock:
+            return {key: self.known[key] for key in keys if key in self.known}
+
+    def learn(self, updated: Dict[str, Optional[str]]) -> None:
+        with self.lock:
+            self.known.update(updated)
+
+    def get(self, key: str, updated: Dict[str, Optional[str]]) -> Optional[Issue]:
+        """Return the cached issue if it and the issues embedded in it are still at
+        the revisions JIRA reports in `updated`."""
+        entry = self.entries.get(key)
+        if entry is None or updated.get(key) is None:
+            return None
+        if entry.get("updated") != updated[key]:
+            return None
+        if key in self.stored:
+            refs = self.ref_timestamps(key)
+        else:
+            refs = entry.get("refs", {})
+        for ref in self.embedded_keys(key):
+            if ref not in refs or refs[ref] != updated.get(ref):
+                return None
+        with self.lock:
+            entry["checked"] = time.time()
+            self.dirty.add(key)
+        return self.parse(entry)
+
+    def put(self, json_issue: Dict[str, Any]) -> None:
+        with self.lock:
+            self.entries[json_issue["key"]] = {
+                "updated": json_issue["fields"].get("updated"),
+                "checked": time.time(),
+                "issue": json_issue,
+            }
+            self.known[json_issue["key"]] = json_issue["fields"].get("updated")
+            self.stored.add(json_issue["key"])
+            self.dirty.add(json_issue["key"])
+
+    def ref_timestamps(self, key: str) -> Dict[str, Optional[str]]:
+        """The timestamps seen during this run of the issues embedded in `key`. Most
+        of them were fetched (or revalidated) in this run too, an embedded issue
+        nothing is known about makes the entry stale next time."""
+        return {
+            ref: self.known[ref] for ref in self.embedded_keys(key) if ref in self.known
+        }
+
+    def record_refs(self) -> None:
+        for key in self.stored:
+            self.entries[key]["refs"] = self.ref_timestamps(key)
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.record_refs()
+        directory = os.path.dirname(self.path)
+        tmp_path = None
+        try:
+            # cached issues may come from a private instance, keep them to ourselves
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # another run may have saved since this one loaded the cache (and --refresh
+            # doesn't load it at all), so only replace the entries this run touched
+            entries = self.read()
+            entries.update((key, self.entries[key]) for key in self.dirty)
+            # write a temporary file (created 0600) first, so an interrupted run can't
+            # truncate the cache and concurrent runs don't write to the same file
+            with tempfile.NamedTemporaryFile(
+                "w",
+                dir=directory,
+                prefix=os.path.basename(self.path) + ".",
+                suffix=".tmp",
+                delete=False,
+            ) as cache:
+                tmp_path = cache.name
+                json.dump(entries, cache)
+            os.replace(tmp_path, self.path)
+        except Exception as ex:
+            log("Failed to save issue cache:", ex)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def issue_cache_path(cache_dir: str, jira_url: str) -> str:
+    """One cache file per JIRA instance, issue keys are only unique within one."""
+    digest = hashlib.sha1(jira_url.rstrip("/").encode("utf-8")).hexdigest()
+    return os.path.join(os.path.expanduser(cache_dir), digest + ".json")
+
+
 class JiraSearch(object):
 
     """This factory will create the actual method used to fetch issues from JIRA.
@@ -39,49 +260,62 @@ class JiraSearch(object):
 
     __base_url: Optional[str] = None
 
-    def __init__(self, url, auth, no_verify_ssl, use_jsessionid, use_bearer) -> None:
+    def __init__(
+        self,
+        url,
+        auth,
+        no_verify_ssl,
+        use_jsessionid,
+        use_bearer,
+        cache: Optional[IssueCache] = None,
+        fetch_workers: int = FETCH_WORKERS,
+    ) -> None:
         self.__base_url = url
         self.url = url + "/rest/api/latest"
         self.auth = auth
         self.no_verify_ssl = no_verify_ssl
         self.use_bearer = use_bearer
         self.use_jsessionid = use_jsessionid
+        self.cache = cache
         self.fields = ",".join(
             [
                 "key",
                 "summary",
                 "status",
-                "description",
                 "issuetype",
                 "issuelinks",
                 "subtasks",
+                "updated",
             ]
         )
 
-    def get(self, uri: str, params={}) -> Response:
-        headers = {"Content-Type": "application/json"}
-
-        if self.use_bearer:
-            headers["Authorization"] = "Bearer " + self.auth
-
-        url = self.url + uri
-
-        if isinstance(self.auth, str) and (self.use_jsessionid):
-            return requests.get(
-                url,
-                params=params,
-                cookies={"JSESSIONID": self.auth},
-                headers=headers,
-                verify=self.no_verify_ssl,
-            )
+        # one pooled session for every request so TCP/TLS connections are reused,
+        # sized to hold a connection per fetch worker so none are discarded
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=max(32, fetch_workers),
+            max_retries=Retry(
+                total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        if use_bearer:
+            self.session.headers["Authorization"] = "Bearer " + auth
+        elif isinstance(auth, str) and use_jsessionid:
+            self.session.cookies.set("JSESSIONID", auth)
         else:
-            return requests.get(
-                url,
-                params=params,
-                headers=headers,
-                verify=(not self.no_verify_ssl),
-                auth=None if self.use_bearer else self.auth,
-            )
+            self.session.auth = auth
+
+    def get(self, uri: str, params={}) -> Response:
+        # verify has to be passed per request: a session-level verify=False loses to
+        # REQUESTS_CA_BUNDLE/CURL_CA_BUNDLE when requests merges the environment
+        return self.session.get(
+            self.url + uri, params=params, verify=not self.no_verify_ssl
+        )
 
     def get_issue(self, key: str) -> Issue:
         """Given an issue key (i.e. JRA-9) return the JSON representation of it.
@@ -89,27 +323,118 @@ class JiraSearch(object):
         if key in FETCHED_ISSUES:
             # log("Already fetched", key)
             return FETCHED_ISSUES[key]
+        fresh = self.cache.get_fresh(key) if self.cache is not None else None
+        if fresh is not None:
+            return self.remember(fresh, key)
         # log("Fetching " + key)
         # we need to expand subtasks and links since that's what we care about here.
         response = self.get("/issue/%s" % key, params={"fields": self.fields})
         response.raise_for_status()
-        ret = Issue.parse_obj(response.json())
-        FETCHED_ISSUES[key] = ret
-        return ret
+        return self.store(parse_json(response), key)
+
+    def store(self, json_issue: Dict[str, Any], key: Optional[str] = None) -> Issue:
+        """Parse a fetched issue and remember it, both for this run and on disk."""
+        ret = Issue.parse_obj(json_issue)
+        if self.cache is not None:
+            self.cache.put(json_issue)
+        return self.remember(ret, key)
+
+    def remember(self, issue: Issue, key: Optional[str] = None) -> Issue:
+        # issues may be fetched from several threads at once, keep the first copy
+        with FETCHED_ISSUES_LOCK:
+            return FETCHED_ISSUES.setdefault(key or issue.key, issue)
 
     def query(self, query: str) -> List[Issue]:
         # log("Querying " + query)
         response = self.get("/search", params={"jql": query, "fields": self.fields})
-        resp_json = response.json()
-        return [Issue.parse_obj(issue) for issue in resp_json["issues"]]
+        resp_json = parse_json(response)
+        # these are complete issues, so the walk doesn't have to fetch them again
+        return [self.store(issue) for issue in resp_json["issues"]]
 
-    def list_ids(self, query: str) -> List[str]:
-        # log("Querying " + query)
+    def search_keys(self, keys: List[str], fields: str) -> Response:
         response = self.get(
-            "/search", params={"jql": query, "fields": "key", "maxResults": 100}
+            "/search",
+            params={
+                "jql": "key in (%s)" % ",".join('"%s"' % key for key in keys),
+                "fields": fields,
+                "maxResults": len(keys),
+                # report unknown keys as warnings rather than failing the search
+                "validateQuery": "warn",
+            },
         )
-        json_issues = response.json()
-        return [issue["key"] for issue in json_issues["issues"]]
+        response.raise_for_status()
+        return response
+
+    def get_unchanged_issues(self, keys: List[str]) -> List[Issue]:
+        """Return the cached copies of the issues in `keys` that weren't updated in JIRA
+        since they were cached, only asking JIRA for their `updated` timestamps."""
+        if self.cache is None:
+            return []
+        ret = []
+        stale = []
+        for key in (key for key in keys if key in self.cache):
+            fresh = self.cache.get_fresh(key)
+            if fresh is not None:
+                ret.append(self.remember(fresh, key))
+            else:
+                stale.append(key)
+        if not stale:
+            return ret
+
+        # the linked issues and subtasks embedded in the cached copies have to be
+        # unchanged too, so ask for their timestamps in the same searches. Earlier
+        # levels already learned many of them, those aren't asked for again.
+        wanted = set(stale)
+        for key in stale:
+            wanted.update(self.cache.embedded_keys(key))
+        updated = self.cache.known_timestamps(wanted)
+        missing = sorted(wanted - updated.keys())
+        learned: Dict[str, Optional[str]] = dict.fromkeys(missing)
+        for batch in chunks(missing, BULK_FETCH_SIZE):
+            response = self.search_keys(batch, "updated")
+            for json_issue in parse_json(response)["issues"]:
+                learned[json_issue["key"]] = json_issue["fields"].get("updated")
+        self.cache.learn(learned)
+        updated.update(learned)
+
+        for key in stale:
+            issue = self.cache.get(key, updated)
+            if issue is not None:
+                ret.append(self.remember(issue, key))
+        return ret
+
+    def get_issues_bulk(self, keys: List[str]) -> List[Issue]:
+        """Fetch many issues with one JQL search per `BULK_FETCH_SIZE` keys instead of
+        one request per issue. Keys JIRA doesn't return (deleted, moved, no
+        permission) are simply left out; `get_issue` remains the fallback for those."""
+        ret = self.get_unchanged_issues(keys)
+        unchanged = set(issue.key for issue in ret)
+        for batch in chunks([k for k in keys if k not in unchanged], BULK_FETCH_SIZE):
+            response = self.search_keys(batch, self.fields)
+            for json_issue in parse_json(response)["issues"]:
+                ret.append(self.store(json_issue))
+        return ret
+
+    def list_ids(self, query: str) -> List[str]:
+        # log("Querying " + query)
+        keys: List[str] = []
+        while True:
+            response = self.get(
+                "/search",
+                params={
+                    "jql": query,
+                    "fields": "key",
+                    "startAt": len(keys),
+                    "maxResults": LIST_IDS_PAGE_SIZE,
+                },
+            )
+            json_issues = parse_json(response)
+            page = [issue["key"] for issue in json_issues["issues"]]
+            keys.extend(page)
+            # the server may cap maxResults below what we asked for, so page by
+            # what actually came back until the reported total is reached
+            if not page or len(keys) >= json_issues.get("total", 0):
+                return keys
 
     def get_issue_uri(self, issue_key: str) -> str:
         return self.__base_url + "/browse/" + issue_key  # type: ignore
@@ -129,21 +454,22 @@ def build_graph_data(
     traverse: bool,
     word_wrap: bool,
     merge_relates: bool,
+    fetch_workers: int = FETCH_WORKERS,
 ):
     """Given a starting image key and the issue-fetching function build up the GraphViz
     data representing relationships between issues. This will consider both subtasks
     and issue links."""
 
+    # these are checked for every link, so only prepare them once
+    excludes_set = frozenset(excludes)
+    issue_excludes_set = frozenset(issue_excludes)
+    project_prefix = start_issue_key.split("-", 1)[0] + "-"
+
     def get_status_color(status_field: Status) -> str:
-        status = status_field.statusCategory.name.upper()
-        if status == "IN PROGRESS":
-            return "yellow"
-        elif status == "DONE":
-            return "green"
-        return "white"
+        return STATUS_COLORS.get(status_field.statusCategory.name.upper(), "white")
 
-    def create_node_text(
-        issue_key: str, fields: Union[IssueFields, Fields], islink: bool = True
+    def format_node_text(
+        issue_key: str, fields: Union[IssueFields, Fields], islink: bool
     ) -> str:
         summary = fields.summary
         status = fields.status
@@ -160,27 +486,33 @@ def build_graph_data(
                 summary = fields.summary[:MAX_SUMMARY_LENGTH] + "..."
         summary = summary.replace('"', '\\"')
 
+        label = f'"{issue_key}\\n({summary})"'
         if islink:
-            return '"{}\\n({})"'.format(issue_key, summary)
+            return label
 
+        attributes = (
+            f'href="{jira.get_issue_uri(issue_key)}", '
+            f'fillcolor="{get_status_color(status)}", style=filled'
+        )
         if fields.issuetype.name == "Epic":
-            return '"{}\\n({})" [href="{}", fillcolor="{}", style=filled, shape=doubleoctagon, color=purple]'.format(
-                issue_key,
-                summary,
-                jira.get_issue_uri(issue_key),
-                get_status_color(status),
-            )
+            attributes += ", shape=doubleoctagon, color=purple"
+        return f"{label} [{attributes}]"
 
-        return '"{}\\n({})" [href="{}", fillcolor="{}", style=filled]'.format(
-            issue_key, summary, jira.get_issue_uri(issue_key), get_status_color(status)
-        )
-
-    def process_link(
-        fields: IssueFields, issue_key: str, link: IssueLink
-    ) -> Optional[Tuple[str, Optional[str]]]:
-        if link.outwardIssue is None and link.inwardIssue is None:
-            return None
+    # the text of a node only depends on its issue, so format it once per issue
+    # instead of once per edge it takes part in
+    node_text_cache: Dict[Tuple[str, bool], str] = {}
 
+    def create_node_text(
+        issue_key: str, fields: Union[IssueFields, Fields], islink: bool = True
+    ) -> str:
+        cache_key = (issue_key, islink)
+        if cache_key not in node_text_cache:
+            node_text_cache[cache_key] = format_node_text(issue_key, fields, islink)
+        return node_text_cache[cache_key]
+
+    def follow_link(link: IssueLink) -> Optional[Tuple[str, str, IssueRef]]:
+        """Return the direction, type and linked issue of `link` if it passes the
+        filters given on the command line. This never needs to hit the network."""
         if link.outwardIssue is not None:
             direction = "outward"
             link_type = link.type.outward
@@ -189,96 +521,103 @@ def build_graph_data(
             direction = "inward"
             link_type = link.type.inward
             linked_issue = link.inwardIssue
+        else:
+            return None
 
         if not link_type or direction not in directions:
             return None
 
-        if linked_issue.key in issue_excludes:
+        if linked_issue.key in issue_excludes_set:
             # log("Skipping " + linked_issue.key + " - explicitly excluded")
             return None
 
-        if ignore_closed and (
-            ((link.inwardIssue) and (link.inwardIssue.fields.status.name == "Closed"))
-            or (
-                (link.outwardIssue)
-                and (link.outwardIssue.fields.status.name == "Closed")
-            )
-        ):
+        if ignore_closed and (linked_issue.fields.status.name == "Closed"):
             # log("Skipping " + linked_issue.key + " - linked key is Closed")
             return None
 
-        if includes not in linked_issue.key:
+        if includes and includes not in linked_issue.key:
             return None
 
-        if link.type.name.strip() in excludes:
+        return direction, link_type, linked_issue
+
+    def process_link(
+        fields: IssueFields, issue_key: str, link: IssueLink
+    ) -> Optional[Tuple[str, Optional[str]]]:
+        followed = follow_link(link)
+        if followed is None:
+            return None
+        direction, link_type, linked_issue = followed
+
+        if link.type.name.strip() in excludes_set:
             return linked_issue.key, None
 
         # arrow = " => " if direction == "outward" else " <= "
         # log(issue_key + arrow + link_type + arrow + linked_issue.key)
 
-        extra = ""
-        if link_type == "blocks":
-            extra = ',color="red"'
-        elif link_type == "has to be done before":
-            extra = ',color="orange"'
-        elif link_type == "relates to" and merge_relates:
+        extra = EDGE_EXTRA.get(link_type, "")
+        if link_type == "relates to" and merge_relates:
             extra = ", dir=both"
 
-        skip_links = [
-            # "added to idea",
-            # "created by",
-            # "has to be done before",
-            # "is blocked by",
-            # "is caused by",
-            # "is child of",
-            # "is cloned by",
-            # "is depended by",
-            # "is discovered by testing",
-            # "is duplicated by",
-            # "is implemented by",
-            # "is resolved by"
-            # "is reviewed by",
-            # "is tested by",
-            # "split from",
-        ]
-
-        if direction not in show_directions or link_type in skip_links:
+        if direction not in show_directions or link_type in SKIP_LINKS:
             node = None
         else:
-            node = '{}->{}[label="{}"{}]'.format(
-                create_node_text(issue_key, fields),
-                create_node_text(linked_issue.key, linked_issue.fields),
-                link_type,
-                extra,
-            )
+            source = create_node_text(issue_key, fields)
+            target = create_node_text(linked_issue.key, linked_issue.fields)
+            node = f'{source}->{target}[label="{link_type}"{extra}]'
 
         return linked_issue.key, node
 
     # since the graph can be cyclic we need to prevent infinite recursion
-    seen = []
+    seen: Set[str] = set()
+    # edges are reached from both of their ends, only keep the first one
+    emitted: Set[str] = set()
 
-    def walk(issue_key: str, graph: List) -> Union[Issue, List[Any]]:
-        """issue is the JSON representation of the issue"""
-        children = []
+    def emit(graph: List, line: str) -> None:
+        if line not in emitted:
+            emitted.add(line)
+            graph.append(line)
 
+    def fetch(issue_key: str) -> Optional[Issue]:
         try:
-            issue: Issue = jira.get_issue(issue_key)
+            return jira.get_issue(issue_key)
         except Exception as ex:
             log("\n\n", ex)
-            return []
+            return None
 
-        fields = issue.fields
-        seen.append(issue_key)
+    def prefetch(executor: ThreadPoolExecutor, keys: List[str]) -> None:
+        """Load the issues in `keys` that aren't cached yet with bulk searches, so the
+        per-issue lookups that follow are cache hits."""
+        missing = sorted(set(keys) - FETCHED_ISSUES.keys())
+        try:
+            list(executor.map(jira.get_issues_bulk, chunks(missing, BULK_FETCH_SIZE)))
+        except Exception as ex:
+            # whatever is still missing gets fetched one by one
+            log("\n\n", ex)
 
+    def skipped(issue_key: str, fields: IssueFields) -> bool:
+        """Whether `issue_key` is left out of the graph, along with everything it
+        links to."""
         if ignore_closed and (fields.status.name == "Closed"):
             # log("Skipping " + issue_key + " - it is Closed")
-            return graph
+            return True
 
-        if not traverse and ((project_prefix + "-") not in issue_key):
+        if not traverse and (project_prefix not in issue_key):
             # log("Skipping " + issue_key + " - not traversing to a different project")
-            return graph
+            return True
+
+        return False
+
+    def process_issue(issue_key: str, issue: Issue, graph: List) -> List[str]:
+        """Append the node and edges of `issue` to `graph` and return the keys of the
+        issues it leads to."""
+        children: List[str] = []
+        fields = issue.fields
+
+        if skipped(issue_key, fields):
+            return children
 
-        graph.append(create_node_text(issue_key, fields, islink=False))
+        emit(graph, create_node_text(issue_key, fields, islink=False))
+        source = create_node_text(issue_key, fields)
 
         if not ignore_subtasks:
             subtask: Union[Issue, IssueRef]
@@ -290,61 +629,99 @@ def build_graph_data(
                 )
                 for subtask in issues:
                     # log(subtask.key + " => references epic => " + issue_key)
-                    node: str = "{}->{}[color=orange]".format(
-                        create_node_text(issue_key, fields),
-                        create_node_text(subtask.key, subtask.fields),
-                    )
-                    graph.append(node)
+                    target = create_node_text(subtask.key, subtask.fields)
+                    node: str = f"{source}->{target}[color=orange]"
+                    emit(graph, node)
                     children.append(subtask.key)
             if fields.subtasks and not ignore_subtasks:
                 for subtask in fields.subtasks:
                     # log(issue_key + " => has subtask => " + subtask.key)
-                    node = '{}->{}[color=blue][label="subtask"]'.format(
-                        create_node_text(issue_key, fields),
-                        create_node_text(subtask.key, subtask.fields),
-                    )
-                    graph.append(node)
+                    target = create_node_text(subtask.key, subtask.fields)
+                    node = f'{source}->{target}[color=blue][label="subtask"]'
+                    emit(graph, node)
                     children.append(subtask.key)
 
         if fields.issuelinks:
             for other_link in fields.issuelinks:
-                if merge_relates:
-                    remove_duplicate_links(issue_key, other_link, "Relates")
                 result = process_link(fields, issue_key, other_link)
                 if result is not None:
+                    if merge_relates and other_link.type.name == MERGED_LINK_TYPE:
+                        remove_duplicate_links(issue_key, other_link, MERGED_LINK_TYPE)
                     # log("Appending " + result[0])
                     children.append(result[0])
                     if result[1] is not None:
-                        graph.append(result[1])
-        # now construct graph data for all subtasks and links of this issue
-        for child in (x for x in children if x not in seen):
-            walk(child, graph)
+                        emit(graph, result[1])
+        return children
+
+    def walk(start_issue_key: str, graph: List) -> List:
+        """Breadth-first walk from `start_issue_key`, fetching each level of the graph
+        concurrently before building its graph data."""
+        frontier = [start_issue_key]
+        with ThreadPoolExecutor(max_workers=fetch_workers) as executor:
+            while frontier:
+                seen.update(frontier)
+                prefetch(executor, frontier)
+                # wait for the whole level so that processing (which may mutate the
+                # cached issues) never races with a fetch
+                issues = list(executor.map(fetch, frontier))
+                if merge_relates:
+                    # remove_duplicate_links needs the issue on the other end of
+                    # the followed links of this level, which are the next level
+                    # anyway, so load them all in one go. Skipped issues don't
+                    # lead anywhere, so their links aren't loaded.
+                    prefetch(
+                        executor,
+                        [
+                            followed[2].key
+                            for issue_key, issue in zip(frontier, issues)
+                            if issue is not None
+                            and not skipped(issue_key, issue.fields)
+                            for followed in map(follow_link, issue.fields.issuelinks)
+                            if followed is not None
+                        ],
+                    )
+                next_frontier: Set[str] = set()
+                for issue_key, issue in zip(frontier, issues):
+                    if issue is None:
+                        if issue_key == start_issue_key:
+                            return []
+                        continue
+                    children = process_issue(issue_key, issue, graph)
+                    next_frontier.update(x for x in children if x not in seen)
+                # now construct graph data for all subtasks and links of this level
+                frontier = sorted(next_frontier)
         return graph
 
+    # links of the fetched issues by (link type, key of the issue on the other end),
+    # built the first time remove_duplicate_links looks at an issue
+    link_index: Dict[str, Dict[Tuple[str, str], List[IssueLink]]] = {}
+
     def remove_duplicate_links(
         issue_key: str, other_link: IssueLink, link_type: str
     ) -> None:
-        linked_issue_key: str
-        outward_issue = other_link.outwardIssue
-        inward_issue = other_link.inwardIssue
-        if outward_issue is None and inward_issue is None:
+        linked_ref = other_end(other_link)
+        if linked_ref is None:
             return
 
-        if outward_issue is not None:
-            linked_issue_key = outward_issue.key
-        elif inward_issue is not None:
-            linked_issue_key = inward_issue.key
-
-        _ = jira.get_issue(linked_issue_key)
-        if FETCHED_ISSUES[linked_issue_key].fields.issuelinks:
-            for link in FETCHED_ISSUES[linked_issue_key].fields.issuelinks:
-                if link.type.name == link_type and (
-                    (link.outwardIssue and link.outwardIssue.key == issue_key)
-                    or (link.inwardIssue and link.inwardIssue.key == issue_key)
-                ):
-                    FETCHED_ISSUES[linked_issue_key].fields.issuelinks.remove(link)
-
-    project_prefix = start_issue_key.split("-", 1)[0]
+        linked = fetch(linked_ref.key)
+        if linked is None:
+            return
+        if linked_ref.key not in link_index:
+            index: Dict[Tuple[str, str], List[IssueLink]] = {}
+            for link in linked.fields.issuelinks:
+                ref = other_end(link)
+                if ref is not None:
+                    index.setdefault((link.type.name, ref.key), []).append(link)
+            link_index[linked_ref.key] = index
+
+        dropped = link_index[linked_ref.key].pop((link_type, issue_key), [])
+        if dropped:
+            # filter in one pass rather than list.remove()-ing each link
+            dropped_ids = set(map(id, dropped))
+            linked.fields.issuelinks = [
+                link for link in linked.fields.issuelinks if id(link) not in dropped_ids
+            ]
+
     return walk(start_issue_key, [])
 
 
@@ -367,19 +744,20 @@ def save_graph(
     Based on the `file_type` provided.
 
     [1]: http://code.google.com/apis/chart/docs/gallery/graphviz.html"""
-    digraph = "digraph{node [shape=" + node_shape + "];%s}" % ";".join(graph_data)
-
-    d = os.path.dirname(__file__)
-    p = d + "/out/"
-    gvp = p + "gv/"
-    pngp = p + "png/"
+    out = os.path.join(os.path.dirname(__file__), "out")
+    gvp = os.path.join(out, "gv")
+    pngp = os.path.join(out, "png")
 
     graph_paths = []
 
     if file_type == FileTypes.ALL or file_type == FileTypes.GRAPHVIZ:
-        graph_path_gv = save_graph_gv(digraph=digraph, file_name=file_name, path=gvp)
+        graph_path_gv = save_graph_gv(
+            graph_data=graph_data, node_shape=node_shape, file_name=file_name, path=gvp
+        )
         graph_paths.append(graph_path_gv)
     if file_type == FileTypes.ALL or file_type == FileTypes.PNG:
+        # the Google API needs the whole graph in the request body
+        digraph = f"digraph{{node [shape={node_shape}];{';'.join(graph_data)}}}"
         graph_path_png = save_graph_png(digraph=digraph, file_name=file_name, path=pngp)
         graph_paths.append(graph_path_png)
 
@@ -392,11 +770,24 @@ def save_graph(
     return graph_paths
 
 
-def save_graph_gv(digraph: str, file_name: str, path: str) -> str:
+def write_digraph(
+    out: TextIO, graph_data: List, head: str, separator: str, tail: str
+) -> None:
+    """Write the graph piece by piece, without joining it into one big string."""
+    out.write(head)
+    for index, line in enumerate(graph_data):
+        if index:
+            out.write(separator)
+        out.write(line)
+    out.write(tail)
+
+
+def save_graph_gv(graph_data: List, node_shape: str, file_name: str, path: str) -> str:
     """Save graph as graphviz file
 
     Args:
-        digraph (str): Code to generate graph
+        graph_data (List): Nodes and edges of the graph
+        node_shape (str): Shape to use for nodes
         file_name (str): Name of file
         path (str): File path to save
 
@@ -404,12 +795,13 @@ def save_graph_gv(digraph: str, file_name: str, path: str) -> str:
         str: Full path to file
     """
 
-    full_path = path + file_name + ".gv"
+    full_path = os.path.join(path, file_name + ".gv")
 
     try:
         with open(full_path, "w") as gv:
-            gv.write(digraph)
-            gv.close()
+            write_digraph(
+                gv, graph_data, f"digraph{{node [shape={node_shape}];", ";", "}"
+            )
     except Exception as ex:
         log("Failed to create graph file:", ex)
 
@@ -428,14 +820,15 @@ def save_graph_png(digraph: str, file_name: str, path: str) -> str:
         str: Full path to file
     """
 
-    full_path = path + file_name + ".png"
+    full_path = os.path.join(path, file_name + ".png")
 
     try:
-        response = requests.post(GOOGLE_CHART_URL, data={"cht": "gv", "chl": digraph})
-        with open(full_path, "w+b") as image:
-            binary_format = bytearray(response.content)
-            image.write(binary_format)
-            image.close()
+        # stream the image to disk instead of holding it in memory
+        with requests.post(
+            GOOGLE_CHART_URL, data={"cht": "gv", "chl": digraph}, stream=True
+        ) as response, open(full_path, "wb") as image:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                image.write(chunk)
     except Exception as ex:
         log("Failed to create image:", ex)
 
@@ -443,11 +836,22 @@ def save_graph_png(digraph: str, file_name: str, path: str) -> str:
 
 
 def print_graph(graph_data: List, node_shape: str) -> None:
-    print(
-        "digraph{\nnode [shape=" + node_shape + "];\n\n%s\n}" % ";\n".join(graph_data)
+    write_digraph(
+        sys.stdout,
+        graph_data,
+        f"digraph{{\nnode [shape={node_shape}];\n\n",
+        ";\n",
+        "\n}\n",
     )
 
 
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got %s" % value)
+    return number
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -618,29 +1022,62 @@ def parse_args() -> argparse.Namespace:
         action="store_false",
         help="Do not merge 'relates to' edges",
     )
+    parser.add_argument(
+        "-W",
+        "--workers",
+        dest="fetch_workers",
+        type=positive_int,
+        default=FETCH_WORKERS,
+        help="How many requests to JIRA to run in parallel (default %s)"
+        % FETCH_WORKERS,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        default=ISSUE_CACHE_DIR,
+        help="Where to keep fetched issues between runs (default %s)" % ISSUE_CACHE_DIR,
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        dest="cache_ttl",
+        type=float,
+        default=0,
+        help="Reuse cached issues checked less than this many seconds ago without "
+        "asking JIRA whether they changed (default 0)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        default=True,
+        action="store_false",
+        help="Do not read or write the issue cache",
+    )
+    parser.add_argument(
+        "--refresh",
+        dest="refresh",
+        default=False,
+        action="store_true",
+        help="Ignore the cached issues and fetch everything again",
+    )
     return parser.parse_args()
 
 
 def filter_duplicates(lst: List) -> List:
-    # Enumerate the List to restore order lately; reduce the sorted List; restore order
-    def append_unique(acc, item):
-        return acc if acc[-1][1] == item[1] else acc.append(item) or acc
-
-    srt_enum = sorted(enumerate(lst), key=lambda i_val: i_val[1])  # type: ignore
-    return [item[1] for item in sorted(reduce(append_unique, srt_enum, [srt_enum[0]]))]
+    # dicts keep insertion order, so this keeps the first occurrence of every item
+    return list(dict.fromkeys(lst))
 
 
 @typing.no_type_check
 def main() -> None:
-    FINISHED = False
+    FINISHED = threading.Event()
 
     def spinner():
         for c in itertools.cycle(["|", "/", "-", "\\"]):
-            if FINISHED:
-                break
             sys.stdout.write("\r🐕 Fetching issues..." + c)
             sys.stdout.flush()
-            time.sleep(0.1)
+            # wakes up as soon as we're done instead of sleeping the tick out
+            if FINISHED.wait(0.1):
+                break
         sys.stdout.write("\r🎉 Woohoo, it's done!       ")
 
     options = parse_args()
@@ -671,16 +1108,41 @@ def main() -> None:
         )
         auth = (user, api_token)
 
-    t = threading.Thread(target=spinner)
-    t.start()
+    # only spin for humans, it would just litter piped output and CI logs
+    if sys.stdout.isatty():
+        t = threading.Thread(target=spinner)
+        t.start()
+
+    cache = None
+    if options.use_cache:
+        cache = IssueCache(
+            issue_cache_path(options.cache_dir, options.jira_url),
+            ttl=options.cache_ttl,
+            load=not options.refresh,
+        )
+        # also save what was fetched when we bail out early
+        atexit.register(cache.save)
 
     jira = JiraSearch(
-        options.jira_url, auth, options.no_verify_ssl, use_jsessionid, use_bearer
+        options.jira_url,
+        auth,
+        options.no_verify_ssl,
+        use_jsessionid,
+        use_bearer,
+        cache,
+        options.fetch_workers,
     )
 
     if options.jql_query is not None:
         options.issues.extend(jira.list_ids(options.jql_query))
 
+    if len(options.issues) > 1:
+        # load all starting issues in bulk instead of one per walk
+        try:
+            jira.get_issues_bulk(options.issues)
+        except Exception as ex:
+            log("\n\n", ex)
+
     graph: List = []
     for issue in options.issues:
         graph_data = build_graph_data(
@@ -697,15 +1159,20 @@ def main() -> None:
             options.traverse,
             options.word_wrap,
             options.merge_relates,
+            options.fetch_workers,
         )
         if not graph_data:
             log("\nFailed to fetch data for:", issue, "\nWas it deleted?\n")
-            FINISHED = True
+            FINISHED.set()
             exit(1)
-        graph = graph + graph_data
+        graph.extend(graph_data)
+
+    if len(options.issues) > 1:
+        # the walks from different issues may have overlapped
+        graph = filter_duplicates(graph)
 
     if options.local:
-        print_graph(filter_duplicates(graph), options.node_shape)
+        print_graph(graph, options.node_shape)
     else:
         file_type = FileTypes.ALL
         if options.gvonly:
@@ -714,14 +1181,14 @@ def main() -> None:
             file_type = FileTypes.PNG
 
         save_graph(
-            graph_data=filter_duplicates(graph),
+            graph_data=graph,
             file_name=options.image_file
             if options.image_file != "issue_graph"
             else "+".join(options.issues),
             node_shape=options.node_shape,
             file_type=file_type,
         )
-    FINISHED = True
+    FINISHED.set()
 
 
 if __name__ == "__main__":
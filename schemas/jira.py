@@ -197,7 +197,7 @@ class IssueFields(BaseModel):
     project: Optional[Dict[Any, Any]] = None
     comment: Optional[Dict[Any, Any]] = None
     worklog: Optional[Dict[Any, Any]] = None
-    updated: Optional[Dict[Any, Any]] = None
+    updated: Optional[str] = None
     timetracking: Optional[Dict[Any, Any]] = None
     priority: Optional[Priority] = Field(None, title="Priority")
 